@@ -1,81 +1,503 @@
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, Response, abort, render_template, request, jsonify, send_file
+from flask.json.provider import JSONProvider
+from flask_compress import Compress
+import orjson
+import cachetools
+import httpx
 import yt_dlp
 import os
+import atexit
 import base64
+import concurrent.futures
+import contextlib
+import copy
+import functools
+import hmac
+import http.cookiejar
+import json
+import logging
+import mimetypes
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
 import time
-import traceback
-from urllib.parse import urlparse
+import types
+from urllib.parse import parse_qs, quote, urlparse
+
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "WARNING").upper())
+logger = logging.getLogger(__name__)
+
+class ORJSONProvider(JSONProvider):
+    """JSON provider backed by orjson's C serializer"""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode('utf-8')
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        # Hand orjson's bytes straight to the response instead of decoding
+        # them to str for Werkzeug to encode again
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj), mimetype='application/json')
 
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
+
+# Requests only carry URLs; a batch of MAX_BATCH_URLS fits well inside this
+app.config['MAX_CONTENT_LENGTH'] = 64 * 1024
+
+# Compress text responses (brotli when the client accepts it); media
+# downloads are already compressed and are left alone
+app.config['COMPRESS_MIMETYPES'] = ['application/json', 'text/html', 'text/css']
+app.config['COMPRESS_LEVEL'] = 6
+app.config['COMPRESS_MIN_SIZE'] = 200
+Compress(app)
+
+# Let a fronting proxy that understands X-Sendfile serve finished files
+app.config['USE_X_SENDFILE'] = os.environ.get("USE_X_SENDFILE") == "1"
+
+# Behind nginx, hand finished files over with X-Accel-Redirect. The prefix
+# must map to an internal location aliased to DOWNLOAD_FOLDER, e.g.
+#   location /protected/ { internal; alias /tmp/downloads/; sendfile on; tcp_nopush on; }
+X_ACCEL_REDIRECT_PREFIX = os.environ.get("X_ACCEL_REDIRECT_PREFIX")
 
 DOWNLOAD_FOLDER = "/tmp/downloads"
 COOKIE_PATH = "/tmp/cookies.txt"
 
+# Pipe downloads straight to the client instead of writing them to
+# DOWNLOAD_FOLDER first. Set STREAM_DOWNLOADS=0 to serve finished files.
+STREAM_DOWNLOADS = os.environ.get("STREAM_DOWNLOADS", "1") != "0"
+STREAM_CHUNK_SIZE = 65536
+
 if not os.path.exists(DOWNLOAD_FOLDER):
     os.makedirs(DOWNLOAD_FOLDER)
 
-def setup_cookies():
-    """Setup cookies from environment variable"""
+def _ram_temp_folder(min_free=2 * 1024 ** 3):
+    """Return a tmpfs folder for yt-dlp's intermediate files, if enabled and roomy"""
+    # Files in /dev/shm count against the container's memory limit, while
+    # statvfs reports the tmpfs size (often half the host's RAM). Only use it
+    # when the instance is known to have memory to spare.
+    if os.environ.get("RAM_TEMP_FOLDER") != "1":
+        return DOWNLOAD_FOLDER
+    try:
+        shm = os.statvfs('/dev/shm')
+    except OSError:
+        return DOWNLOAD_FOLDER
+    if shm.f_bavail * shm.f_frsize < min_free:
+        return DOWNLOAD_FOLDER
+    # A private subfolder, since other processes keep files in /dev/shm too
+    folder = '/dev/shm/youtube-downloader'
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+# Separate video and audio streams are written here before being merged.
+# Set RAM_TEMP_FOLDER=1 to keep them in RAM so only the finished file touches
+# the disk.
+TEMP_FOLDER = _ram_temp_folder()
+
+CLEANUP_INTERVAL = 300
+MAX_FILE_AGE = 3600
+MAX_DOWNLOAD_BYTES = 2 * 1024 ** 3
+
+# Both caches are keyed by video id. INFO_CACHE holds raw yt-dlp info so
+# /download can reuse the extraction done by /get_formats; those dicts run to
+# hundreds of KB, so only a few are kept. SUMMARY_CACHE holds the small
+# /get_formats responses and can afford to remember far more videos.
+CACHE_TTL = 600
+INFO_CACHE = cachetools.TTLCache(maxsize=64, ttl=CACHE_TTL)
+SUMMARY_CACHE = cachetools.TTLCache(maxsize=2048, ttl=CACHE_TTL)
+CACHE_LOCK = threading.Lock()
+
+# Enables the /cache/clear admin route when set
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+
+# Idle YoutubeDL instances keyed by their options. Reusing them keeps HTTP
+# connections and the deciphered player JS alive between requests.
+_YDL_POOL = {}
+_YDL_POOL_LOCK = threading.Lock()
+
+# Fans out /get_formats_batch lookups. Kept small so a batch does not get the
+# server rate limited by YouTube.
+EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=8)
+MAX_BATCH_URLS = 20
+BATCH_TIMEOUT = 30
+
+# Every download holds a network stream and often an ffmpeg process; streamed
+# ones also run their own yt-dlp interpreter. gevent would accept them all, so
+# only a few run at once per worker, and a request that cannot get a slot
+# within DOWNLOAD_QUEUE_TIMEOUT seconds is turned away.
+MAX_CONCURRENT_DOWNLOADS = 4
+DOWNLOAD_SLOTS = threading.BoundedSemaphore(MAX_CONCURRENT_DOWNLOADS)
+DOWNLOAD_QUEUE_TIMEOUT = 30
+
+# gevent lets a worker accept any number of requests, so cap how many
+# yt-dlp extractions it runs against YouTube at once
+MAX_CONCURRENT_EXTRACTIONS = 8
+EXTRACT_SEMAPHORE = threading.BoundedSemaphore(MAX_CONCURRENT_EXTRACTIONS)
+
+# Extractions currently running, keyed by video id
+_INFLIGHT = {}
+_INFLIGHT_LOCK = threading.Lock()
+INFLIGHT_TIMEOUT = 60
+
+# The host is matched exactly, so look-alikes such as youtube.com.evil.com
+# are rejected
+_URL_HOST_RE = re.compile(r'^https?://([^/?#:@]+)(?:[/?#]|$)', re.IGNORECASE)
+_VALID_HOSTS = frozenset({'youtube.com', 'youtu.be', 'm.youtube.com', 'music.youtube.com'})
+
+# Longer URLs are rejected outright; real video links are far shorter
+MAX_URL_LENGTH = 2048
+
+_VIDEO_ID_RE = re.compile(r'[0-9A-Za-z_-]{11}')
+# Paths that carry the video id as their second segment, e.g. /shorts/<id>
+_ID_PATH_PREFIXES = frozenset({'shorts', 'embed', 'live'})
+
+# Pooled HTTP/2 client for InnerTube lookups, created once per worker so TLS
+# handshakes are paid once. Its cookie jar refuses every cookie, so nothing
+# YouTube sets while answering one user is replayed for another.
+_HTTP = httpx.Client(
+    http2=True,
+    limits=httpx.Limits(max_keepalive_connections=50, max_connections=200, keepalive_expiry=75),
+    timeout=httpx.Timeout(10.0, connect=3.0),
+    cookies=http.cookiejar.CookieJar(policy=http.cookiejar.DefaultCookiePolicy(allowed_domains=[])),
+)
+atexit.register(_HTTP.close)
+INNERTUBE_PLAYER_URL = 'https://www.youtube.com/youtubei/v1/player?prettyPrint=false'
+INNERTUBE_CLIENT = {'clientName': 'ANDROID', 'clientVersion': '19.09.37', 'androidSdkVersion': 30}
+INNERTUBE_USER_AGENT = 'com.google.android.youtube/19.09.37 (Linux; U; Android 11) gzip'
+
+# Extraction attempts per request (the first try plus YTDLP_RETRIES), and the
+# errors worth retrying; anything else (private, removed, unsupported) fails
+# the same way on every attempt
+FETCH_ATTEMPTS = 1 + max(0, int(os.environ.get('YTDLP_RETRIES', 1)))
+TRANSIENT_ERRORS = (
+    'Too Many Requests', 'HTTP Error 429', 'HTTP Error 5',
+    'timed out', 'Connection reset', 'Temporary failure in name resolution',
+)
+
+@functools.lru_cache(maxsize=1)
+def ensure_cookiefile():
+    """Write cookies from the environment to COOKIE_PATH on first use"""
     cookies_b64 = os.environ.get("YOUTUBE_COOKIES")
     if not cookies_b64:
-        print("No cookies provided - some videos may not work")
+        logger.warning("No cookies provided - some videos may not work")
         return False
     
     try:
-        # Decode base64 cookies
-        cookies_text = base64.b64decode(cookies_b64).decode('utf-8')
+        # Decode base64 cookies; cookies.txt is written as the raw bytes
+        cookies_data = base64.b64decode(cookies_b64)
         
-        # Write to file
-        with open(COOKIE_PATH, 'w', encoding='utf-8') as f:
-            f.write(cookies_text)
+        # Write to a temporary file and rename it into place so concurrent
+        # workers never see a partially written cookie file. mkstemp creates
+        # it readable by this user only.
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(COOKIE_PATH))
+        try:
+            view = memoryview(cookies_data)
+            while view:
+                view = view[os.write(fd, view):]
+        finally:
+            os.close(fd)
+        os.replace(tmp_path, COOKIE_PATH)
         
-        print("Cookies setup successfully")
+        logger.info("Cookies setup successfully")
         return True
     except Exception as e:
-        print(f"Failed to setup cookies: {e}")
+        logger.error("Failed to setup cookies: %s", e)
         return False
 
-# Setup cookies on startup
-setup_cookies()
+def _log_progress(status):
+    """Record finished yt-dlp downloads at debug level"""
+    if status.get('status') == 'finished':
+        logger.debug("Downloaded %s (%s bytes)", status.get('filename'), status.get('downloaded_bytes'))
+
+# yt-dlp only gets chatty when debug logging is on, and then it reports
+# through our logger instead of writing to stdout itself
+YTDLP_DEBUG = logger.isEnabledFor(logging.DEBUG)
+
+_BASE_OPTS = {
+    'quiet': True,
+    'no_warnings': not YTDLP_DEBUG,
+    'logger': logger,
+    'noplaylist': True,
+    # Only YouTube URLs get this far, so skip registering the ~1800 other
+    # extractors every time a YoutubeDL is built
+    'allowed_extractors': ['youtube', 'youtube:tab'],
+    'ignoreerrors': False,
+    'extract_flat': False,
+    # Read-only, since every options dict shares this one
+    'http_headers': types.MappingProxyType({
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+        'Accept-Language': 'en-US,en;q=0.9',
+        'Accept-Encoding': 'gzip, deflate, br',
+    }),
+    # Short ASCII names on disk; the title is only used for the download name.
+    # format_id keeps different qualities of one video apart.
+    'outtmpl': '%(id)s.%(format_id)s.%(ext)s',
+    'paths': {'home': DOWNLOAD_FOLDER, 'temp': TEMP_FOLDER},
+    'cachedir': '/tmp/yt-dlp-cache',
+    'http_chunk_size': 10485760,
+    # yt-dlp starts with 1 KiB reads and writes and only grows the block
+    # size as it measures throughput; start at 1 MiB to cut write syscalls
+    'buffersize': 1048576,
+}
+
+if YTDLP_DEBUG:
+    _BASE_OPTS['progress_hooks'] = [_log_progress]
+
+# Info extraction, shared by /get_formats and every /download through
+# INFO_CACHE. The HLS/DASH manifests stay in: live streams and some clients
+# only list their downloadable formats there. Translated caption lists are
+# never used, so that round trip is skipped.
+INFO_OPTS = {
+    'skip_download': True,
+    'extractor_args': {'youtube': {'skip': ['translated_subs']}},
+}
 
 def is_valid_youtube_url(url):
     """Validate YouTube URL"""
-    try:
-        parsed = urlparse(url)
-        valid_domains = ['youtube.com', 'youtu.be', 'www.youtube.com', 'm.youtube.com']
-        return any(domain in parsed.netloc for domain in valid_domains)
-    except Exception:
-        return False
+    # Checked before the memoised helpers so their caches only ever hold
+    # short strings
+    return len(url) <= MAX_URL_LENGTH and _is_youtube_host(url)
+
+@functools.lru_cache(maxsize=4096)
+def _is_youtube_host(url):
+    """Return whether a URL points at a YouTube host"""
+    match = _URL_HOST_RE.match(url)
+    return match is not None and match.group(1).lower().removeprefix('www.') in _VALID_HOSTS
+
+@functools.lru_cache(maxsize=4096)
+def extract_video_id(url):
+    """Return the 11 character video id in a YouTube URL, or None"""
+    # Only look where yt-dlp does, so a v= or youtu.be/ buried elsewhere in
+    # the URL cannot make it key one video's info under another's id
+    parts = urlparse(url)
+    host = (parts.hostname or '').removeprefix('www.')
+    segments = [s for s in parts.path.split('/') if s]
+    
+    if host == 'youtu.be':
+        candidate = segments[0] if segments else None
+    elif segments == ['watch']:
+        candidate = parse_qs(parts.query).get('v', [None])[0]
+    elif len(segments) >= 2 and segments[0] in _ID_PATH_PREFIXES:
+        candidate = segments[1]
+    else:
+        candidate = None
+    
+    return candidate if candidate and _VIDEO_ID_RE.fullmatch(candidate) else None
+
+def cache_key(url):
+    """Return the video id for a YouTube URL, or the URL itself"""
+    return extract_video_id(url) or url
+
+def get_cached_info(url):
+    """Return cached yt-dlp info for a URL, or None if missing or expired"""
+    with CACHE_LOCK:
+        return INFO_CACHE.get(cache_key(url))
+
+def cache_info(info):
+    """Store raw yt-dlp info under the id of the video it describes"""
+    with CACHE_LOCK:
+        INFO_CACHE[info['id']] = info
+
+def get_cached_summary(url):
+    """Return the cached /get_formats response for a URL, or None"""
+    with CACHE_LOCK:
+        return SUMMARY_CACHE.get(cache_key(url))
+
+def cache_summary(url, summary):
+    """Store the /get_formats response for a URL"""
+    with CACHE_LOCK:
+        SUMMARY_CACHE[cache_key(url)] = summary
 
 def build_ydl_opts(extra=None):
     """Return a yt-dlp options dict."""
-    opts = {
-        'quiet': True,
-        'no_warnings': True,
-        'noplaylist': True,
-        'ignoreerrors': False,
-        'extract_flat': False,
-        'http_headers': {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-            'Accept-Language': 'en-US,en;q=0.9',
-            'Accept-Encoding': 'gzip, deflate, br',
-        },
-        'outtmpl': f'{DOWNLOAD_FOLDER}/%(title).100s.%(ext)s',
-    }
+    # YoutubeDL keeps and mutates the dict it is given, but it replaces
+    # http_headers rather than editing it, so a shallow copy is enough
+    opts = dict(_BASE_OPTS)
     
     # Add cookies if available
-    if os.path.exists(COOKIE_PATH):
+    if ensure_cookiefile():
         opts['cookiefile'] = COOKIE_PATH
-        print("Using cookies for authentication")
     
     if extra:
         opts.update(extra)
     return opts
 
-def get_video_info(url):
-    """Get video information"""
-    print(f"Fetching info for URL: {url}")
+def _freeze(value):
+    """Return a hashable copy of a yt-dlp options value"""
+    if isinstance(value, dict):
+        return frozenset((k, _freeze(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+@contextlib.contextmanager
+def get_ydl(extra=None):
+    """Check out a pooled YoutubeDL for these options, creating one if needed"""
+    # Everything else in the options is fixed for the life of the process,
+    # so the extras alone identify a pool and the full dict is only built
+    # when a new instance is needed
+    key = _freeze(extra or {})
+    
+    # A YoutubeDL instance is not thread-safe, so each one is handed to a
+    # single request at a time and put back afterwards
+    with _YDL_POOL_LOCK:
+        idle = _YDL_POOL.setdefault(key, [])
+        ydl = idle.pop() if idle else None
+    
+    if ydl is None:
+        ydl = yt_dlp.YoutubeDL(build_ydl_opts(extra))
+    
+    try:
+        yield ydl
+    finally:
+        with _YDL_POOL_LOCK:
+            _YDL_POOL[key].append(ydl)
+
+def _extract_info(url):
+    """Run a yt-dlp info extraction and cache the result"""
+    with EXTRACT_SEMAPHORE, get_ydl(INFO_OPTS) as ydl:
+        info = ydl.extract_info(url, download=False)
+    
+    # Cached under the id yt-dlp resolved rather than the one parsed from
+    # the URL, so an odd URL can only ever fill its own video's entry
+    if info and info.get('id'):
+        cache_info(info)
+    return info
+
+def fetch_info(url):
+    """Return raw yt-dlp info for a URL, extracting it on a cache miss"""
+    info = get_cached_info(url)
+    if info is not None:
+        return info
+    
+    # Concurrent misses for the same video share one extraction: the first
+    # caller runs it and the rest wait on its future
+    key = cache_key(url)
+    with _INFLIGHT_LOCK:
+        future = _INFLIGHT.get(key)
+        owner = future is None
+        if owner:
+            future = concurrent.futures.Future()
+            _INFLIGHT[key] = future
+    
+    if not owner:
+        info = future.result(timeout=INFLIGHT_TIMEOUT)
+        # The owner's URL may have resolved to a different video than its
+        # key suggested; only take its result if it is the one asked for
+        if not info or info.get('id') == key:
+            return info
+        return _extract_info(url)
+    
+    try:
+        info = _extract_info(url)
+        future.set_result(info)
+        return info
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _INFLIGHT_LOCK:
+            del _INFLIGHT[key]
+
+def fetch_info_with_retry(url):
+    """Fetch raw yt-dlp info, retrying errors that are likely transient"""
+    for attempt in range(FETCH_ATTEMPTS):
+        try:
+            return fetch_info(url)
+        except yt_dlp.utils.DownloadError as e:
+            error_msg = str(e)
+            if attempt == FETCH_ATTEMPTS - 1 or not any(t in error_msg for t in TRANSIENT_ERRORS):
+                raise
+            logger.info("Retrying after transient error: %s", error_msg)
+            # Short and jittered so concurrent retries don't hit YouTube in lockstep
+            time.sleep(0.25 + random.random() * 0.5)
+
+def fast_video_info(url):
+    """Fetch video details from YouTube's InnerTube player API, or None"""
+    video_id = extract_video_id(url)
+    if video_id is None:
+        return None
+    
+    try:
+        response = _HTTP.post(
+            INNERTUBE_PLAYER_URL,
+            json={'context': {'client': INNERTUBE_CLIENT}, 'videoId': video_id},
+            headers={'User-Agent': INNERTUBE_USER_AGENT},
+        )
+        response.raise_for_status()
+        data = response.json()
+        
+        if data.get('playabilityStatus', {}).get('status') != 'OK':
+            return None
+        
+        details = data['videoDetails']
+        streaming = data.get('streamingData', {})
+        formats = streaming.get('formats', []) + streaming.get('adaptiveFormats', [])
+        thumbnails = details.get('thumbnail', {}).get('thumbnails') or [{}]
+        
+        # Shaped like yt-dlp's info so summarize_info handles both
+        return {
+            'id': video_id,
+            'title': details['title'],
+            'thumbnail': thumbnails[-1].get('url', ''),
+            'duration': int(details.get('lengthSeconds', 0)),
+            'uploader': details.get('author', 'Unknown'),
+            'formats': [
+                {'height': f.get('height'), 'vcodec': f.get('mimeType', '')}
+                for f in formats if f.get('mimeType', '').startswith('video/')
+            ],
+        }
+    except (httpx.HTTPError, KeyError, TypeError, ValueError) as e:
+        logger.debug("InnerTube lookup failed for %s: %s", video_id, e)
+        return None
+
+def prefetch_info(url):
+    """Warm INFO_CACHE for a URL so a following /download skips extraction"""
+    try:
+        fetch_info_with_retry(url)
+    except Exception as e:
+        logger.debug("Prefetch failed for %s: %s", url, e)
+
+def summarize_info(info):
+    """Reduce yt-dlp style info to the /get_formats response"""
+    # Collect the available video heights in a single pass. Audio-only
+    # formats have no height, so the vcodec lookup rarely runs.
+    heights = set()
+    for f in info.get("formats", ()):
+        height = f.get('height')
+        if height and height >= 144 and f.get('vcodec') != 'none':
+            heights.add(height)
+    resolutions = [f"{h}p" for h in sorted(heights, reverse=True)]
+    resolutions.append('mp3')
+    
+    # Format duration as M:SS, or H:MM:SS for videos over an hour
+    duration = info.get('duration', 0)
+    if duration:
+        hours, rest = divmod(int(duration), 3600)
+        minutes, seconds = divmod(rest, 60)
+        duration_str = f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+    else:
+        duration_str = "Unknown"
+    
+    return {
+        'title': info.get('title', 'Unknown Title'),
+        'thumbnail': info.get('thumbnail', ''),
+        'duration': duration_str,
+        'duration_seconds': duration,
+        'resolutions': resolutions,
+        'uploader': info.get('uploader', 'Unknown'),
+    }
+
+def get_video_info(url, prefetch=False):
+    """Get video information, optionally warming INFO_CACHE for /download"""
+    logger.debug("Fetching info for URL: %s", url)
     
     if not url or not url.strip():
         return {'error': 'No URL provided'}
@@ -83,45 +505,36 @@ def get_video_info(url):
     if not is_valid_youtube_url(url):
         return {'error': 'Invalid YouTube URL'}
     
+    summary = get_cached_summary(url)
+    if summary is not None:
+        return summary
+    
     try:
-        ydl_opts = build_ydl_opts({'skip_download': True})
+        # Prefer info /download can reuse, then the cheap InnerTube lookup,
+        # and only run a full yt-dlp extraction when both miss
+        info = get_cached_info(url)
+        if info is None:
+            info = fast_video_info(url)
+            if info is None:
+                info = fetch_info_with_retry(url)
+            elif prefetch:
+                # InnerTube answered, but /download needs yt-dlp's full info.
+                # Extract it in the background so the download usually finds
+                # it cached, or joins the extraction while it is in flight.
+                EXECUTOR.submit(prefetch_info, url)
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            
-            if not info:
-                return {'error': 'Video not found'}
-            
-            # Get available formats
-            formats = info.get("formats", [])
-            video_formats = [f for f in formats if f.get('vcodec') != 'none']
-            resolutions = sorted(
-                {f.get("height") for f in video_formats if f.get("height") and f.get("height") >= 144},
-                reverse=True
-            )
-            
-            # Format duration
-            duration = info.get('duration', 0)
-            if duration:
-                minutes = duration // 60
-                seconds = duration % 60
-                duration_str = f"{minutes}:{seconds:02d}"
-            else:
-                duration_str = "Unknown"
-            
-            return {
-                'title': info.get('title', 'Unknown Title'),
-                'thumbnail': info.get('thumbnail', ''),
-                'duration': duration_str,
-                'duration_seconds': duration,
-                'resolutions': [str(r) + "p" for r in resolutions] + ['mp3'],
-                'uploader': info.get('uploader', 'Unknown'),
-                'view_count': info.get('view_count', 0),
-            }
+        if not info:
+            return {'error': 'Video not found'}
+        
+        summary = summarize_info(info)
+        # Don't file another video's details under this URL's id
+        if info.get('id') == cache_key(url):
+            cache_summary(url, summary)
+        return summary
             
     except yt_dlp.utils.DownloadError as e:
         error_msg = str(e)
-        print(f"YouTube error: {error_msg}")
+        logger.warning("YouTube error: %s", error_msg)
         
         if 'Sign in' in error_msg or 'bot' in error_msg:
             return {'error': 'blocked', 'message': 'YouTube is blocking this request. The server needs valid YouTube cookies to access videos.'}
@@ -129,52 +542,223 @@ def get_video_info(url):
             return {'error': 'This video is private'}
         elif 'Video unavailable' in error_msg:
             return {'error': 'Video unavailable'}
+        elif 'Too Many Requests' in error_msg or 'HTTP Error 429' in error_msg:
+            return {'error': 'YouTube is rate limiting requests, please try again shortly'}
         else:
             return {'error': 'YouTube blocked the request'}
             
     except Exception as e:
-        print(f"Unexpected error: {e}")
+        logger.error("Unexpected error: %s", e)
         return {'error': 'Failed to fetch video information'}
 
-def download_video(url, resolution):
-    """Download video with specified resolution"""
+def video_opts(resolution):
+    """Return yt-dlp options for a video download"""
+    return {
+        'format': f'best[height<={resolution}]',
+        'merge_output_format': 'mp4'
+    }
+
+def audio_opts():
+    """Return yt-dlp options for an MP3 download"""
+    return {
+        'format': 'bestaudio/best',
+        'postprocessors': [{
+            'key': 'FFmpegExtractAudio',
+            'preferredcodec': 'mp3',
+            'preferredquality': '192',
+        }],
+    }
+
+def download_with_info(info, resolution):
+    """Download from already extracted info, skipping a second extraction"""
     try:
-        ydl_opts = build_ydl_opts({
-            'format': f'best[height<={resolution}]',
-            'merge_output_format': 'mp4'
-        })
+        extra = audio_opts() if resolution == 'mp3' else video_opts(resolution)
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
+        with get_ydl(extra) as ydl:
+            # process_ie_result annotates the dict it is given, so keep the
+            # cached copy pristine for other requests
+            info = ydl.process_ie_result(copy.deepcopy(info), download=True)
             filename = ydl.prepare_filename(info)
-            return filename
+            if resolution == 'mp3':
+                filename = os.path.splitext(filename)[0] + '.mp3'
+            return filename, info.get('title')
     except Exception as e:
-        print(f"Download error: {e}")
+        logger.error("Download error: %s", e)
         raise
 
-def download_audio(url):
-    """Download audio as MP3"""
+def download_name(title, ext):
+    """Return the filename a download is offered to the user under"""
+    return f"{yt_dlp.utils.sanitize_filename(title or 'download')}{ext}"
+
+def content_disposition(filename):
+    """Return an attachment Content-Disposition header for a filename"""
+    ascii_name = filename.encode('ascii', 'ignore').decode('ascii').replace('"', '')
+    return f"attachment; filename=\"{ascii_name or 'download'}\"; filename*=UTF-8''{quote(filename)}"
+
+def stream_download(info, quality):
+    """Stream a download to the client while yt-dlp is still fetching it"""
+    # The caller holds a DOWNLOAD_SLOTS slot; cleanup releases it once the
+    # stream is closed or fails to start
+    if quality == 'mp3':
+        fmt, ext, mimetype = 'bestaudio/best', 'mp3', 'audio/mpeg'
+    else:
+        # mp4 only: the response is labelled video/mp4 before yt-dlp picks a
+        # format, so a missing mp4 must fail here rather than send a webm
+        fmt, ext, mimetype = f'best[height<={quality}][ext=mp4]', 'mp4', 'video/mp4'
+    
+    procs = []
+    info_path = None
+    closed = False
+    
+    def cleanup():
+        nonlocal closed
+        if closed:
+            return
+        closed = True
+        try:
+            for proc in procs:
+                if proc.poll() is None:
+                    proc.kill()
+                proc.wait()
+                if proc.stdout:
+                    proc.stdout.close()
+            if info_path:
+                os.unlink(info_path)
+        finally:
+            DOWNLOAD_SLOTS.release()
+    
     try:
-        ydl_opts = build_ydl_opts({
-            'format': 'bestaudio/best',
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '192',
-            }],
-        })
-        
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
-            base_path = ydl.prepare_filename(info)
-            return os.path.splitext(base_path)[0] + '.mp3'
-    except Exception as e:
-        print(f"Audio download error: {e}")
+        # Hand the extracted info to the yt-dlp CLI so it does not extract again
+        fd, info_path = tempfile.mkstemp(suffix='.info.json')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(yt_dlp.YoutubeDL.sanitize_info(info), f)
+        
+        # --buffer-size matches the in-process 'buffersize' so the pipe is fed
+        # in 1 MiB blocks from the start rather than 1 KiB ones
+        procs.append(subprocess.Popen(
+            [sys.executable, '-m', 'yt_dlp', '--quiet', *([] if YTDLP_DEBUG else ['--no-warnings']),
+             '--buffer-size', '1M', '-f', fmt, '-o', '-', '--load-info-json', info_path],
+            stdout=subprocess.PIPE,
+        ))
+        
+        if quality == 'mp3':
+            procs.append(subprocess.Popen(
+                ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-i', 'pipe:0',
+                 '-vn', '-f', 'mp3', '-b:a', '192k', 'pipe:1'],
+                stdin=procs[0].stdout,
+                stdout=subprocess.PIPE,
+            ))
+            # Only ffmpeg should hold the read end of yt-dlp's pipe
+            procs[0].stdout.close()
+        
+        stdout = procs[-1].stdout
+        
+        # Wait for the first bytes so a failed download still gets an error
+        # response rather than an empty file
+        first_chunk = stdout.read1(STREAM_CHUNK_SIZE)
+        if not first_chunk:
+            raise yt_dlp.utils.DownloadError('yt-dlp produced no output')
+    except BaseException:
+        cleanup()
         raise
+    
+    def generate():
+        try:
+            chunk = first_chunk
+            while chunk:
+                yield chunk
+                chunk = stdout.read1(STREAM_CHUNK_SIZE)
+        finally:
+            cleanup()
+    
+    filename = download_name(info.get('title'), f'.{ext}')
+    response = Response(
+        generate(),
+        mimetype=mimetype,
+        headers={'Content-Disposition': content_disposition(filename)},
+        direct_passthrough=True,
+    )
+    # A generator that is closed before its first iteration never runs its
+    # finally block, so also clean up when the server closes the response
+    response.call_on_close(cleanup)
+    return response
+
+def cleanup_old_files():
+    """Delete downloads and leftover temporary files older than MAX_FILE_AGE"""
+    cutoff = time.time() - MAX_FILE_AGE
+    for folder in {DOWNLOAD_FOLDER, TEMP_FOLDER}:
+        # scandir's entries answer is_file() and stat() from a single syscall
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file(follow_symlinks=False) and entry.stat().st_ctime < cutoff:
+                        os.unlink(entry.path)
+                except FileNotFoundError:
+                    pass
+
+def sweep_downloads(max_bytes=MAX_DOWNLOAD_BYTES):
+    """Delete the least recently served downloads until the folder fits max_bytes"""
+    files = []
+    total = 0
+    with os.scandir(DOWNLOAD_FOLDER) as entries:
+        for entry in entries:
+            try:
+                if entry.is_file(follow_symlinks=False):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+            except FileNotFoundError:
+                pass
+    
+    files.sort()
+    for _, size, path in files:
+        if total <= max_bytes:
+            break
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+def _cleanup_loop():
+    """Run cleanup_old_files every CLEANUP_INTERVAL seconds"""
+    while True:
+        time.sleep(CLEANUP_INTERVAL)
+        try:
+            cleanup_old_files()
+        except Exception as e:
+            logger.error("Cleanup error: %s", e)
+
+# Sweep in the background so no request ever waits on it
+threading.Thread(target=_cleanup_loop, daemon=True).start()
+
+def prewarm_ydl_pool():
+    """Build the info-only (and, for file downloads, MP3) YoutubeDL before the first request"""
+    try:
+        with get_ydl(INFO_OPTS) as ydl:
+            # Importing and initialising the YouTube extractor is the slow part
+            ydl.get_info_extractor('Youtube')
+        # Streamed downloads run the yt-dlp CLI and never use this instance
+        if not STREAM_DOWNLOADS:
+            with get_ydl(audio_opts()):
+                pass
+    except Exception as e:
+        logger.error("Failed to prewarm yt-dlp: %s", e)
+
+threading.Thread(target=prewarm_ydl_pool, daemon=True).start()
+
+@functools.lru_cache(maxsize=1)
+def _index_html():
+    """Render the page once; it has no per-request context"""
+    # Rendered on first use rather than at import because url_for needs
+    # a request context
+    return render_template('index.html')
 
 @app.route('/')
 def index():
-    return render_template('index.html')
+    # Not immutable: the page changes on deploy, so browsers revalidate hourly
+    return Response(_index_html(), mimetype='text/html',
+                    headers={'Cache-Control': 'public, max-age=3600'})
 
 @app.route('/get_formats', methods=['POST'])
 def get_formats():
@@ -183,9 +767,37 @@ def get_formats():
     if not url:
         return jsonify({'error': 'No URL provided'}), 400
     
-    info = get_video_info(url)
+    info = get_video_info(url, prefetch=True)
     return jsonify(info), 200
 
+@app.route('/get_formats_batch', methods=['POST'])
+def get_formats_batch():
+    data = request.get_json(silent=True)
+    urls = data.get('urls') if isinstance(data, dict) else None
+    
+    if not isinstance(urls, list) or not urls:
+        return jsonify({'error': 'No URLs provided'}), 400
+    
+    if len(urls) > MAX_BATCH_URLS:
+        return jsonify({'error': f'At most {MAX_BATCH_URLS} URLs per batch'}), 400
+    
+    # No prefetch here: INFO_CACHE only holds a few videos, and a batch would
+    # start a full extraction for every one of them
+    futures = [EXECUTOR.submit(get_video_info, str(url).strip()) for url in urls]
+    
+    # One deadline for the whole batch. Lookups still queued by then are
+    # cancelled so they don't keep the shared executor busy for nobody.
+    done, pending = concurrent.futures.wait(futures, timeout=BATCH_TIMEOUT)
+    for future in pending:
+        future.cancel()
+    
+    results = [
+        future.result() if future in done else {'error': 'Timed out fetching video information'}
+        for future in futures
+    ]
+    
+    return jsonify({'results': results}), 200
+
 @app.route('/download', methods=['POST'])
 def download():
     url = request.form.get('url', '').strip()
@@ -194,23 +806,81 @@ def download():
     if not url or not quality:
         return "Missing URL or quality", 400
     
+    if not is_valid_youtube_url(url):
+        return "Invalid YouTube URL", 400
+    
+    # quality ends up in yt-dlp's format selector and the YoutubeDL pool key,
+    # so only accept the values the page offers
+    if quality != 'mp3' and not (quality.isascii() and quality.isdigit() and len(quality) <= 4):
+        return "Invalid quality", 400
+    
     try:
-        if quality == 'mp3':
-            file_path = download_audio(url)
-        else:
-            file_path = download_video(url, quality)
+        # /get_formats leaves this cached, or still extracting in the
+        # background when InnerTube answered it, in which case this joins
+        # that extraction. Either way the download itself never extracts again.
+        info = fetch_info_with_retry(url)
+        if not info:
+            raise yt_dlp.utils.DownloadError('Video not found')
+        
+        if not DOWNLOAD_SLOTS.acquire(timeout=DOWNLOAD_QUEUE_TIMEOUT):
+            return "Too many downloads in progress, please try again shortly", 503
+        
+        if STREAM_DOWNLOADS:
+            # The slot passes to the stream, which frees it when it closes
+            return stream_download(info, quality)
         
-        safe_filename = os.path.basename(file_path)
-        return send_file(file_path, as_attachment=True, download_name=safe_filename)
+        try:
+            file_path, title = download_with_info(info, quality)
+        finally:
+            DOWNLOAD_SLOTS.release()
+        
+        name = download_name(title, os.path.splitext(file_path)[1])
+        
+        # Mark the file as recently used, then trim the folder in the
+        # background so the disk cannot fill up between periodic cleanups
+        os.utime(file_path)
+        EXECUTOR.submit(sweep_downloads)
+        
+        if X_ACCEL_REDIRECT_PREFIX:
+            # nginx streams the file with sendfile(2); Python never reads it
+            response = Response(
+                mimetype=mimetypes.guess_type(file_path)[0] or 'application/octet-stream',
+                headers={'Content-Disposition': content_disposition(name)},
+            )
+            response.headers['X-Accel-Redirect'] = X_ACCEL_REDIRECT_PREFIX + quote(os.path.basename(file_path))
+            return response
+        
+        # send_file encodes non-ASCII titles per RFC 5987
+        # conditional adds ETag/Last-Modified validation and Range support
+        return send_file(file_path, as_attachment=True, download_name=name,
+                         conditional=True, max_age=0)
         
     except Exception as e:
-        print(f"Download failed: {e}")
-        return f"Download failed: {str(e)}", 500
+        logger.error("Download failed: %s", e)
+        return f"Download failed: {e}", 500
+
+@app.route('/cache/clear', methods=['POST'])
+def clear_cache():
+    if not ADMIN_TOKEN:
+        abort(404)
+    
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), ADMIN_TOKEN):
+        abort(403)
+    
+    with CACHE_LOCK:
+        INFO_CACHE.clear()
+        SUMMARY_CACHE.clear()
+    return jsonify({'status': 'cleared'})
 
 @app.route('/health')
 def health_check():
     return jsonify({'status': 'healthy'})
 
 if __name__ == "__main__":
+    # Production runs under gunicorn (see gunicorn.conf.py). The built-in
+    # server is only meant for local development.
+    if os.environ.get("FLASK_ENV") != "development":
+        sys.exit("Run with: gunicorn -c gunicorn.conf.py app:app "
+                 "(or set FLASK_ENV=development to use the dev server)")
     port = int(os.environ.get("PORT", 10000))
     app.run(host="0.0.0.0", port=port, debug=False)
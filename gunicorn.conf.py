@@ -0,0 +1,24 @@
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 10000)}"
+
+# yt-dlp spends most of its time waiting on the network. gevent turns those
+# waits into cooperative yields, so one worker serves many requests at once.
+worker_class = 'gevent'
+
+# Each worker holds its own yt-dlp pool and info cache, so a couple of
+# processes go further than one per core on a small instance
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+
+# The app is imported after gevent has patched each worker, so the locks,
+# thread pools and HTTP clients it creates at import are gevent-aware.
+# Preloading would build them in the unpatched master instead.
+preload_app = False
+
+# Most connections sit idle on YouTube, so each worker can hold plenty of them
+worker_connections = 1000
+
+keepalive = 75
+
+# Downloads and ffmpeg conversions routinely outlast the 30s default
+timeout = 300